@@ -2,6 +2,7 @@ import streamlit as st
 import joblib
 import numpy as np
 import os
+import profiling
 
 # -----------------------------------------------------
 # PAGE CONFIGURATION
@@ -12,6 +13,12 @@ st.set_page_config(
     layout="wide",
 )
 
+# Opt-in profiling (INSURANCE_PROFILE=1 or ?profile=1), see profiling.py
+_profiler = profiling.start_rerun("app", watch={
+    "CSS / markdown blocks": ("streamlit/elements/markdown.py", "markdown"),
+    "Model load": ("joblib/numpy_pickle.py", "load"),
+})
+
 # -----------------------------------------------------
 # CUSTOM CSS - PREMIUM DEEP BLUE THEME
 # -----------------------------------------------------
@@ -169,6 +176,7 @@ if os.path.exists(model_path):
     st.sidebar.success("✅ Model Loaded Successfully!")
 else:
     st.sidebar.error("❌ Model not found. Please check the path.")
+    profiling.finish_rerun(_profiler)
     st.stop()
 
 # -----------------------------------------------------
@@ -288,3 +296,5 @@ st.markdown("""
         </p>
     </div>
 """, unsafe_allow_html=True)
+
+profiling.finish_rerun(_profiler)
@@ -0,0 +1,350 @@
+# audit_log.py
+"""
+Append-only audit log for insurance quotes.
+
+Every prediction is recorded with its raw inputs, the encoded feature vector,
+the hash of the model file that produced it, the predicted cost and a
+timestamp. Records are handed to a background writer thread which
+group-commits them in batches into SQLite segment files, so the request path
+only pays for a queue put. Segments are rotated once they reach a row limit
+and are never modified afterwards. A batch that fails to commit is retried
+(and, if the log is shutting down, saved to an `unwritten-*.jsonl` file)
+rather than dropped; failures are reported through `logging` and
+`AuditLog.last_error`.
+
+Command line usage:
+    python audit_log.py query  --dir audit_logs [--since ISO] [--until ISO] [--model-hash H] [--limit N]
+    python audit_log.py replay --dir audit_logs --model new_model.pkl
+"""
+import argparse
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from scoring import FEATURES, file_sha256
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUDIT_DIR = "audit_logs"
+SEGMENT_PREFIX = "quotes-"
+SEGMENT_SUFFIX = ".sqlite"
+
+# writer retry policy: back off up to this many seconds between attempts; once the
+# log is closing, give up after CLOSE_RETRIES attempts and spill the batch to JSONL
+MAX_RETRY_DELAY = 5.0
+CLOSE_RETRIES = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    age REAL,
+    sex TEXT,
+    bmi REAL,
+    children REAL,
+    smoker TEXT,
+    region TEXT,
+    encoded TEXT NOT NULL,
+    model_hash TEXT,
+    prediction REAL NOT NULL
+)
+"""
+
+INSERT_SQL = """
+INSERT INTO quotes (ts, age, sex, bmi, children, smoker, region, encoded, model_hash, prediction)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _segment_paths(directory):
+    pattern = os.path.join(directory, f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")
+    return sorted(glob.glob(pattern))
+
+
+class AuditLog:
+    """
+    Non-blocking, batched quote recorder.
+
+    `record()` enqueues and returns immediately. A daemon thread drains the
+    queue, committing up to `batch_size` records per transaction or whatever
+    has arrived after `flush_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, directory=DEFAULT_AUDIT_DIR, batch_size=64, flush_interval=0.5,
+                 max_segment_rows=50000):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_segment_rows = max_segment_rows
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue = queue.Queue()
+        # guards _closed so no record can be queued behind the shutdown sentinel
+        self._lock = threading.Lock()
+        self._closed = False
+        self._conn = None
+        self._segment_rows = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- request path ---
+    def record(self, inputs, encoded, model_hash, prediction, ts=None):
+        """Queue one quote for writing. Never touches the disk."""
+        row = (
+            time.time() if ts is None else ts,
+            *(inputs.get(f) for f in FEATURES),
+            json.dumps([float(v) for v in encoded]),
+            model_hash,
+            float(prediction),
+        )
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("audit log is closed")
+            self._queue.put(row)
+
+    def flush(self):
+        """Block until every queued record has been committed."""
+        self._queue.join()
+
+    def close(self):
+        """Flush outstanding records and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    # --- writer thread ---
+    def _open_segment(self):
+        existing = _segment_paths(self.directory)
+        if existing:
+            # resume the newest segment if it still has room
+            conn = sqlite3.connect(existing[-1])
+            conn.execute(SCHEMA)
+            rows = conn.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]
+            if rows < self.max_segment_rows:
+                conn.execute("PRAGMA journal_mode=WAL")
+                self._conn, self._segment_rows = conn, rows
+                return
+            conn.close()
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{stamp}{SEGMENT_SUFFIX}")
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+        self._segment_rows = 0
+
+    def _close_segment(self):
+        if self._conn is None:
+            return
+        try:
+            # fold the WAL back in so a closed segment is a single self-contained file
+            self._conn.execute("PRAGMA journal_mode=DELETE")
+        except sqlite3.Error:
+            logger.warning("audit log: could not checkpoint segment before closing it", exc_info=True)
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def _drop_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+
+    def _write_batch(self, batch):
+        """Commit `batch`, removing rows from it as they are committed."""
+        while batch:
+            if self._conn is None:
+                self._open_segment()
+            elif self._segment_rows >= self.max_segment_rows:
+                self._close_segment()
+                self._open_segment()
+            room = self.max_segment_rows - self._segment_rows
+            chunk = batch[:room]
+            with self._conn:
+                self._conn.executemany(INSERT_SQL, chunk)
+            self._segment_rows += len(chunk)
+            del batch[:len(chunk)]
+
+    def _write_with_retry(self, batch):
+        """Retry until `batch` is committed. Nothing is dropped: if the log is
+        closing and the database stays unwritable, the rows go to a JSONL file."""
+        attempt = 0
+        while batch:
+            try:
+                self._write_batch(batch)
+                self.last_error = None
+            except Exception as e:
+                attempt += 1
+                self.last_error = e
+                self._drop_connection()
+                logger.exception("audit log: failed to write %d records (attempt %d)", len(batch), attempt)
+                if self._closed and attempt >= CLOSE_RETRIES:
+                    self._spill(batch)
+                    return
+                time.sleep(min(0.1 * 2 ** attempt, MAX_RETRY_DELAY))
+
+    def _spill(self, batch):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(self.directory, f"unwritten-{stamp}.jsonl")
+        columns = ["ts", *FEATURES, "encoded", "model_hash", "prediction"]
+        with open(path, "w") as f:
+            for row in batch:
+                f.write(json.dumps(dict(zip(columns, row))) + "\n")
+        logger.critical("audit log: %d records could not be committed, saved to %s", len(batch), path)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            size = len(batch)
+            self._write_with_retry(batch)
+            for _ in range(size + (1 if stop else 0)):
+                self._queue.task_done()
+        self._close_segment()
+
+
+# --- read side ---
+def iter_quotes(directory=DEFAULT_AUDIT_DIR, since=None, until=None, model_hash=None, limit=None):
+    """
+    Yield recorded quotes as dicts, oldest first, across all segments.
+    `since`/`until` are unix timestamps.
+    """
+    clauses, params = [], []
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("ts < ?")
+        params.append(until)
+    if model_hash is not None:
+        clauses.append("model_hash = ?")
+        params.append(model_hash)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT * FROM quotes{where} ORDER BY ts, id"
+
+    emitted = 0
+    for path in _segment_paths(directory):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(sql, params):
+                quote = dict(row)
+                quote["encoded"] = json.loads(quote["encoded"])
+                quote["segment"] = os.path.basename(path)
+                yield quote
+                emitted += 1
+                if limit is not None and emitted >= limit:
+                    return
+        finally:
+            conn.close()
+
+
+def replay(model, quotes, batch_size=1024):
+    """
+    Re-score historical quotes with `model`. Yields (quote, new_prediction)
+    pairs; predictions are computed in vectorised batches.
+    """
+    pending = []
+    for quote in quotes:
+        pending.append(quote)
+        if len(pending) >= batch_size:
+            yield from _score(model, pending)
+            pending = []
+    if pending:
+        yield from _score(model, pending)
+
+
+def _score(model, quotes):
+    X = np.array([q["encoded"] for q in quotes], dtype=float)
+    for quote, pred in zip(quotes, model.predict(X)):
+        yield quote, float(pred)
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query and replay the quote audit log.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("query", "replay"):
+        p = sub.add_parser(name)
+        p.add_argument("--dir", default=DEFAULT_AUDIT_DIR, help="audit log directory")
+        p.add_argument("--since", help="ISO timestamp, inclusive")
+        p.add_argument("--until", help="ISO timestamp, exclusive")
+        p.add_argument("--model-hash", help="only quotes produced by this model hash")
+        p.add_argument("--limit", type=int)
+    sub.choices["replay"].add_argument("--model", required=True, help="model .pkl to replay against")
+    args = parser.parse_args(argv)
+
+    quotes = iter_quotes(args.dir, _parse_time(args.since), _parse_time(args.until),
+                         args.model_hash, args.limit)
+
+    if args.command == "query":
+        for q in quotes:
+            print(json.dumps(q))
+        return 0
+
+    import joblib
+
+    model = joblib.load(args.model)
+    new_hash = file_sha256(args.model)
+    count, abs_sum, max_abs = 0, 0.0, 0.0
+    for quote, new_pred in replay(model, quotes):
+        diff = new_pred - quote["prediction"]
+        count += 1
+        abs_sum += abs(diff)
+        max_abs = max(max_abs, abs(diff))
+        print(json.dumps({
+            "id": quote["id"],
+            "segment": quote["segment"],
+            "ts": quote["ts"],
+            "old_model_hash": quote["model_hash"],
+            "new_model_hash": new_hash,
+            "old_prediction": quote["prediction"],
+            "new_prediction": new_pred,
+            "diff": diff,
+        }))
+    if count:
+        print(f"# replayed {count} quotes: mean |diff| = {abs_sum / count:,.2f}, max |diff| = {max_abs:,.2f}")
+    else:
+        print("# no quotes matched")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
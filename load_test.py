@@ -0,0 +1,313 @@
+# load_test.py
+"""
+Replay-based regression and load test for insurance models.
+
+Replays recorded quotes (from the audit log) or synthetic ones at a fixed
+request rate against a candidate model, either in-process or through a local
+HTTP stand-in for the scoring service, then reports throughput, latency
+percentiles and prediction differences versus the current model.
+
+At a fixed rate, latency is measured from each request's *scheduled* send
+time, so a backlog building up in the scorer shows up in the percentiles
+instead of being hidden by the load generator slowing down. With --rps 0,
+--concurrency closed-loop workers send back to back and latency is pure
+scoring time.
+
+Exit status is 1 if any of the --max-* / --min-* gates fail, so this can be
+used to gate a model deployment:
+    python load_test.py --model new_insurance_model.pkl --rps 200 --requests 5000 \\
+        --max-p99-ms 25 --max-mean-abs-diff 500
+"""
+import argparse
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+
+from audit_log import DEFAULT_AUDIT_DIR, iter_quotes
+from scoring import REGION_MAP, SEX_MAP, SMOKER_MAP, encode_row, predict
+
+
+# --- request sources ---
+def synthetic_requests(n, seed=0):
+    """Encoded feature vectors drawn roughly like the insurance.csv population."""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        rows.append(encode_row(
+            rng.randint(18, 64),
+            rng.choice(list(SEX_MAP)),
+            round(min(max(rng.gauss(30.7, 6.1), 16.0), 53.0), 2),
+            rng.choice([0, 0, 0, 1, 1, 2, 2, 3, 4, 5]),
+            "Yes" if rng.random() < 0.2 else "No",
+            rng.choice(list(REGION_MAP)),
+        ))
+    return np.array(rows, dtype=float)
+
+
+def recorded_requests(n, audit_dir=DEFAULT_AUDIT_DIR):
+    """Encoded feature vectors of the most recent quotes in the audit log, oldest first."""
+    rows = deque((q["encoded"] for q in iter_quotes(audit_dir)), maxlen=n)
+    if not rows:
+        raise SystemExit(f"No recorded quotes found in {audit_dir!r}")
+    return np.array(rows, dtype=float)
+
+
+# --- scoring targets ---
+class InProcessTarget:
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, row):
+        return float(predict(self.model, row.reshape(1, -1))[0])
+
+    def close(self):
+        pass
+
+
+class _PredictHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        pred = predict(self.server.model, np.array([body["features"]], dtype=float))[0]
+        payload = json.dumps({"prediction": float(pred)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpTarget:
+    """
+    POSTs {"features": [...]} to <url>/predict. If no URL is given a local
+    stand-in server is started on an ephemeral port, serving `model`.
+    """
+
+    def __init__(self, model=None, host=None, port=None):
+        self.server = None
+        if host is None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", 0), _PredictHandler)
+            self.server.daemon_threads = True
+            self.server.model = model
+            host, port = self.server.server_address
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.host, self.port = host, port
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            conn.connect()
+            # headers and body go out as separate writes; don't let Nagle hold the body back
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def __call__(self, row):
+        body = json.dumps({"features": row.tolist()})
+        conn = self._conn()
+        try:
+            conn.request("POST", "/predict", body, {"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError):
+            self._local.conn = None
+            conn.close()
+            raise
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status}")
+        return json.loads(data)["prediction"]
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+# --- load generation ---
+def run_load(target, X, rps, concurrency):
+    """
+    Send every row of X to `target` at `rps` requests/second, or with rps=0
+    as fast as `concurrency` closed-loop workers can go. Returns
+    (predictions, latencies_s, errors, wall_time_s).
+
+    Open-loop latency counts from each request's scheduled send time; in
+    closed-loop mode there is no schedule, so it is the scoring time alone.
+    """
+    n = len(X)
+    preds = np.full(n, np.nan)
+    latencies = np.full(n, np.nan)
+    errors = []
+
+    def fire(i, scheduled=None):
+        started = time.perf_counter() if scheduled is None else scheduled
+        try:
+            preds[i] = target(X[i])
+            latencies[i] = time.perf_counter() - started
+        except Exception as e:
+            errors.append((i, repr(e)))
+
+    start = time.perf_counter()
+    if rps > 0:
+        interval = 1.0 / rps
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for i in range(n):
+                scheduled = start + i * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(fire, i, scheduled)
+    else:
+        indices = iter(range(n))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    i = next(indices, None)
+                if i is None:
+                    return
+                fire(i)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+    wall = time.perf_counter() - start
+    return preds, latencies, errors, wall
+
+
+def summarize(preds, latencies, errors, wall, baseline_preds):
+    ok = ~np.isnan(latencies)
+    lat_ms = latencies[ok] * 1000.0
+    diffs = preds[ok] - baseline_preds[ok]
+    report = {
+        "requests": int(len(preds)),
+        "succeeded": int(ok.sum()),
+        "errors": len(errors),
+        "wall_time_s": wall,
+        "throughput_rps": float(ok.sum() / wall) if wall > 0 else 0.0,
+    }
+    if ok.any():
+        p50, p95, p99 = np.percentile(lat_ms, [50, 95, 99])
+        report.update({
+            "latency_ms": {"p50": p50, "p95": p95, "p99": p99, "max": float(lat_ms.max())},
+            "prediction_diff": {
+                "mean_abs": float(np.abs(diffs).mean()),
+                "max_abs": float(np.abs(diffs).max()),
+                "mean": float(diffs.mean()),
+                "rmse": float(np.sqrt((diffs ** 2).mean())),
+            },
+        })
+    return report
+
+
+def check_gates(report, args):
+    failures = []
+    if report["errors"] > args.max_errors:
+        failures.append(f"errors {report['errors']} > {args.max_errors}")
+    if "latency_ms" not in report:
+        failures.append("no successful requests")
+        return failures
+    if args.max_p99_ms is not None and report["latency_ms"]["p99"] > args.max_p99_ms:
+        failures.append(f"p99 {report['latency_ms']['p99']:.2f} ms > {args.max_p99_ms} ms")
+    if args.min_throughput is not None and report["throughput_rps"] < args.min_throughput:
+        failures.append(f"throughput {report['throughput_rps']:.1f} rps < {args.min_throughput} rps")
+    if args.max_mean_abs_diff is not None and report["prediction_diff"]["mean_abs"] > args.max_mean_abs_diff:
+        failures.append(f"mean |diff| {report['prediction_diff']['mean_abs']:,.2f} > {args.max_mean_abs_diff:,.2f}")
+    return failures
+
+
+def print_report(report, failures):
+    print(f"Requests:    {report['succeeded']}/{report['requests']} ok, {report['errors']} errors")
+    print(f"Wall time:   {report['wall_time_s']:.2f} s")
+    print(f"Throughput:  {report['throughput_rps']:.1f} req/s")
+    if "latency_ms" in report:
+        lat = report["latency_ms"]
+        print(f"Latency:     p50 {lat['p50']:.2f} ms | p95 {lat['p95']:.2f} ms | p99 {lat['p99']:.2f} ms | max {lat['max']:.2f} ms")
+        diff = report["prediction_diff"]
+        print(f"Pred. diff:  mean |diff| ${diff['mean_abs']:,.2f} | max |diff| ${diff['max_abs']:,.2f} | "
+              f"bias ${diff['mean']:,.2f} | RMSE ${diff['rmse']:,.2f}")
+    print("Gates:       " + ("PASS" if not failures else "FAIL - " + "; ".join(failures)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay quotes against a model and report latency and prediction diffs.")
+    parser.add_argument("--model", default="insurance_model.pkl", help="candidate model under test")
+    parser.add_argument("--baseline", default="insurance_model.pkl", help="current model to diff predictions against")
+    parser.add_argument("--source", choices=["synthetic", "recorded"], default="synthetic")
+    parser.add_argument("--audit-dir", default=DEFAULT_AUDIT_DIR, help="audit log directory for --source recorded")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rps", type=float, default=100.0, help="target request rate, 0 = unthrottled")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--target", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", help="host:port of a running scoring service (default: start a local stand-in)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--min-throughput", type=float)
+    parser.add_argument("--max-mean-abs-diff", type=float)
+    parser.add_argument("--max-errors", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.requests < 1:
+        parser.error("--requests must be at least 1")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rps < 0:
+        parser.error("--rps must be >= 0")
+
+    # the pickled model was fitted on a DataFrame; scoring plain arrays is intended
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    model = joblib.load(args.model)
+    baseline = model if args.baseline == args.model else joblib.load(args.baseline)
+
+    if args.source == "recorded":
+        X = recorded_requests(args.requests, args.audit_dir)
+    else:
+        X = synthetic_requests(args.requests, args.seed)
+    baseline_preds = predict(baseline, X)
+
+    if args.target == "http":
+        if args.url:
+            host, _, port = args.url.partition(":")
+            target = HttpTarget(host=host, port=int(port or 80))
+        else:
+            target = HttpTarget(model)
+    else:
+        target = InProcessTarget(model)
+
+    # warm up connections / lazy imports outside the measured window
+    target(X[0])
+    try:
+        preds, latencies, errors, wall = run_load(target, X, args.rps, args.concurrency)
+    finally:
+        target.close()
+
+    report = summarize(preds, latencies, errors, wall, baseline_preds)
+    failures = check_gates(report, args)
+    if args.json:
+        print(json.dumps(dict(report, gate_failures=failures), indent=2, default=float))
+    else:
+        print_report(report, failures)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
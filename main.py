@@ -1,14 +1,19 @@
 # app.py
 import streamlit as st
-import numpy as np
 import pandas as pd
 import os
+import io
+import hashlib
+import joblib
 import plotly.graph_objects as go
 import plotly.express as px
 from streamlit_lottie import st_lottie
 import json
 import requests
 import time
+import profiling
+from audit_log import AuditLog, file_sha256
+from scoring import FEATURES, SEX_MAP, SMOKER_MAP, REGION_MAP, prepare_input, predict_with_interval, stats_match_model, stats_path_for
 
 # Configure page with wide layout
 st.set_page_config(
@@ -18,6 +23,15 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Opt-in profiling (INSURANCE_PROFILE=1 or ?profile=1), see profiling.py
+_profiler = profiling.start_rerun("main", watch={
+    "CSS / markdown blocks": ("streamlit/elements/markdown.py", "markdown"),
+    "Lottie loads": ("main.py", "load_lottie_url"),
+    "Model load (cache misses)": ("main.py", "load_model_from_path"),
+    "Sleeps": ("~", "<built-in method time.sleep>"),
+    "Plotly charts": ("streamlit/elements/plotly_chart.py", "plotly_chart"),
+})
+
 # Custom CSS for enhanced styling with beautiful gradient background
 st.markdown("""
 <style>
@@ -103,10 +117,31 @@ input[type="range"] { display: none !important; }
 """, unsafe_allow_html=True)
 
 # --- helper: model loader ---
+@st.cache_data(max_entries=8)
+def model_file_hash(path: str, mtime: float):
+    # mtime is part of the cache key so a replaced model file gets a new hash
+    return file_sha256(path)
+
+@st.cache_resource(max_entries=4)
+def load_model_from_path(path: str, model_hash: str):
+    # keyed on the content hash, so a different model uploaded to the same path is reloaded;
+    # the bytes are checked against the hash so the audit log can never stamp the wrong model
+    with open(path, "rb") as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != model_hash:
+        raise ValueError(f"`{path}` changed while it was being loaded, please retry")
+    return joblib.load(io.BytesIO(data))
+
+# --- helper: interval statistics saved next to the model by train_model.py ---
 @st.cache_resource
-def load_model_from_path(path: str):
+def load_interval_stats(path: str, mtime: float):
     return joblib.load(path)
 
+# --- helper: quote audit log (one background writer per server process) ---
+@st.cache_resource
+def get_audit_log():
+    return AuditLog(os.environ.get("AUDIT_LOG_DIR", "audit_logs"))
+
 # --- Load Lottie animation ---
 def load_lottie_url(url: str):
     try:
@@ -121,16 +156,6 @@ def load_lottie_url(url: str):
 lottie_health = load_lottie_url("https://assets1.lottiefiles.com/packages/lf20_5njp3vgg.json")
 lottie_doctor = load_lottie_url("https://assets1.lottiefiles.com/packages/lf20_k6myfzbd.json")
 
-# --- mappings used in the notebook ---
-SEX_MAP = {"Male": 0, "Female": 1}
-SMOKER_MAP = {"Yes": 0, "No": 1}
-REGION_MAP = {
-    "Southeast": 0,
-    "Southwest": 1,
-    "Northeast": 2,
-    "Northwest": 3
-}
-
 # Header with animation and floating effect
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
@@ -157,6 +182,8 @@ with st.sidebar:
     st.write("The app will try to load `insurance_model.pkl` from the app folder. You can also upload a model file.")
     default_model_path = "insurance_model.pkl"
     model = None
+    model_path = None
+    model_hash = None
     model_status = st.empty()
 
     uploaded_file = st.file_uploader("📁 Upload a model (.pkl)", type=["pkl", "joblib"])
@@ -169,14 +196,19 @@ with st.sidebar:
             with open(tmp_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
             try:
-                model = load_model_from_path(tmp_path)
+                # hash the uploaded bytes directly: the file is rewritten (new mtime) on every rerun
+                tmp_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+                model = load_model_from_path(tmp_path, tmp_hash)
+                model_path, model_hash = tmp_path, tmp_hash
                 model_status.success("✅ Model loaded successfully!")
             except Exception as e:
                 model_status.error(f"❌ Failed to load model: {e}")
     else:
         if os.path.exists(default_model_path):
             try:
-                model = load_model_from_path(default_model_path)
+                default_hash = model_file_hash(default_model_path, os.path.getmtime(default_model_path))
+                model = load_model_from_path(default_model_path, default_hash)
+                model_path, model_hash = default_model_path, default_hash
                 model_status.success(f"✅ Model loaded from `{default_model_path}`.")
             except Exception as e:
                 model_status.error(f"❌ Failed to load `{default_model_path}`: {e}")
@@ -227,18 +259,6 @@ with st.form(key="input_form"):
     with submit_col2:
         submit = st.form_submit_button("🚀 Predict Insurance Cost", use_container_width=True)
 
-# Prediction logic
-def prepare_input(age, sex, bmi, children, smoker, region):
-    """
-    Returns a 2D numpy array in the same order the model expects:
-    [age, sex_encoded, bmi, children, smoker_encoded, region_encoded]
-    """
-    sex_enc = SEX_MAP[sex]
-    smoker_enc = SMOKER_MAP[smoker]
-    region_enc = REGION_MAP[region]
-    arr = np.array([age, sex_enc, bmi, children, smoker_enc, region_enc], dtype=float).reshape(1, -1)
-    return arr
-
 def create_gauge_chart(value, min_val=0, max_val=50000):
     """Create a gauge chart for the prediction"""
     fig = go.Figure(go.Indicator(
@@ -308,77 +328,143 @@ def calculate_feature_impact(age, sex, bmi, children, smoker, region, base_predi
     
     return features, impacts
 
+def compute_results(model, inputs, interval_stats=None):
+    """Run the predict -> DataFrame -> charts pipeline once for a set of inputs."""
+    age, sex, bmi, children, smoker, region = inputs
+    X_input = prepare_input(age, sex, bmi, children, smoker, region)
+    if interval_stats is not None:
+        pred, lower, upper = predict_with_interval(model, X_input, interval_stats, level=0.95)
+        pred_value, interval = float(pred[0]), (float(lower[0]), float(upper[0]))
+    else:
+        pred_value, interval = float(model.predict(X_input)[0]), None
+
+    features, impacts = calculate_feature_impact(age, sex, bmi, children, smoker, region, pred_value)
+    feature_df = pd.DataFrame({
+        'Feature': ['Age', 'Sex', 'BMI', 'Children', 'Smoker', 'Region'],
+        'Value': [age, sex, bmi, children, smoker, region],
+        'Encoded Value': [age, SEX_MAP[sex], bmi, children, SMOKER_MAP[smoker], REGION_MAP[region]],
+        'Impact (USD)': impacts
+    })
+    return {
+        'inputs': inputs,
+        'encoded': X_input[0],
+        'pred_value': pred_value,
+        'interval': interval,
+        'gauge_fig': create_gauge_chart(pred_value),
+        'impact_fig': create_feature_impact_chart(features, impacts, pred_value),
+        'feature_df': feature_df,
+    }
+
+# --- session-level result cache ---
+# Widget interactions (expanders, scenario buttons) rerun the script with submit=False.
+# Results are kept in st.session_state keyed on (inputs, model hash, interval stats
+# file mtime or None) so those reruns redraw from cache instead of repeating the
+# predict / DataFrame / charting pipeline.
+MAX_CACHED_RESULTS = 16
+if "result_cache" not in st.session_state:
+    st.session_state.result_cache = {}
+    st.session_state.last_result_key = None
+if model is None:
+    st.session_state.last_result_key = None
+
 if submit:
     if model is None:
         st.error("❌ No model loaded. Please upload `insurance_model.pkl` in the sidebar or place it next to this app.")
     else:
         try:
-            # Show loading animation
-            with st.spinner("🔮 Predicting insurance cost..."):
-                time.sleep(1.5)  # Simulate processing time
-                
-                X_input = prepare_input(age, sex, bmi, children, smoker, region)
-                prediction = model.predict(X_input)
-                pred_value = float(prediction[0])
-            
-            # Display prediction with enhanced visualization
-            st.markdown("---")
-            st.subheader("📊 Prediction Results")
-            
-            # Create three columns for results display
-            col1, col2, col3 = st.columns([2, 1, 1])
-            
-            with col1:
-                # Gauge chart
-                gauge_fig = create_gauge_chart(pred_value)
-                st.plotly_chart(gauge_fig, use_container_width=True)
-            
-            with col2:
-                # Main prediction box
-                st.markdown('<div class="prediction-box pulse">', unsafe_allow_html=True)
-                st.metric(label="Predicted Insurance Cost", value=f"${pred_value:,.2f}")
-                
-                # Cost category
-                if pred_value < 8000:
-                    st.success("💰 **Low Cost Range**")
-                    st.write("This is below average for most plans")
-                elif pred_value < 15000:
-                    st.warning("💵 **Moderate Cost Range**")
-                    st.write("This is typical for standard plans")
-                else:
-                    st.error("💸 **High Cost Range**")
-                    st.write("Consider premium coverage options")
-                
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            with col3:
-                # Quick stats
-                st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                st.metric("Age Impact", f"+{age * 250:,.0f}")
-                st.metric("BMI Impact", f"+{max(0, (bmi - 18.5) * 300):,.0f}")
-                st.metric("Smoker Impact", f"+{15000 if smoker == 'Yes' else 0:,.0f}")
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Feature impact visualization
-            st.subheader("📈 Feature Impact Analysis")
-            features, impacts = calculate_feature_impact(age, sex, bmi, children, smoker, region, pred_value)
-            impact_fig = create_feature_impact_chart(features, impacts, pred_value)
-            st.plotly_chart(impact_fig, use_container_width=True)
-            
-            # Show input features in an attractive way
-            with st.expander("🔍 View Detailed Input Features"):
-                feature_data = {
-                    'Feature': ['Age', 'Sex', 'BMI', 'Children', 'Smoker', 'Region'],
-                    'Value': [age, sex, bmi, children, smoker, region],
-                    'Encoded Value': [age, SEX_MAP[sex], bmi, children, SMOKER_MAP[smoker], REGION_MAP[region]],
-                    'Impact (USD)': impacts
-                }
-                feature_df = pd.DataFrame(feature_data)
-                st.dataframe(feature_df.style.background_gradient(subset=['Impact (USD)'], cmap='Blues'), use_container_width=True)
-                
+            inputs = (age, sex, bmi, children, smoker, region)
+            stats_path = stats_path_for(model_path)
+            stats_mtime = os.path.getmtime(stats_path) if os.path.exists(stats_path) else None
+            result_key = (inputs, model_hash, stats_mtime)
+            cache = st.session_state.result_cache
+
+            if result_key not in cache:
+                # Show loading animation
+                with st.spinner("🔮 Predicting insurance cost..."):
+                    time.sleep(1.5)  # Simulate processing time
+                    if len(cache) >= MAX_CACHED_RESULTS:
+                        cache.pop(next(iter(cache)))
+                    interval_stats = None
+                    if stats_mtime is not None:
+                        interval_stats = load_interval_stats(stats_path, stats_mtime)
+                        if not stats_match_model(interval_stats, model_hash):
+                            interval_stats = None  # stale stats from a different fit
+                    cache[result_key] = compute_results(model, inputs, interval_stats)
+            st.session_state.last_result_key = result_key
+            result = cache[result_key]
+
+            # Record the quote; this only enqueues, the disk write happens in the background
+            try:
+                audit_log = get_audit_log()
+                audit_log.record(
+                    dict(zip(FEATURES, inputs)),
+                    result['encoded'],
+                    model_hash,
+                    result['pred_value'],
+                )
+                if audit_log.last_error is not None:
+                    st.warning(f"⚠️ Audit log writes are failing and being retried: {audit_log.last_error}")
+            except Exception as e:
+                st.warning(f"⚠️ Quote could not be added to the audit log: {e}")
         except Exception as e:
+            st.session_state.last_result_key = None
             st.error(f"❌ Prediction failed: {e}")
 
+# only redraw a result produced by the model that is loaded now
+last_key = st.session_state.last_result_key
+result = st.session_state.result_cache.get(last_key) if last_key and last_key[1] == model_hash else None
+if result is not None:
+    r_age, r_sex, r_bmi, r_children, r_smoker, r_region = result['inputs']
+    pred_value = result['pred_value']
+
+    # Display prediction with enhanced visualization
+    st.markdown("---")
+    st.subheader("📊 Prediction Results")
+
+    # Create three columns for results display
+    col1, col2, col3 = st.columns([2, 1, 1])
+
+    with col1:
+        # Gauge chart
+        st.plotly_chart(result['gauge_fig'], use_container_width=True)
+
+    with col2:
+        # Main prediction box
+        st.markdown('<div class="prediction-box pulse">', unsafe_allow_html=True)
+        st.metric(label="Predicted Insurance Cost", value=f"${pred_value:,.2f}")
+        if result['interval'] is not None:
+            lower, upper = result['interval']
+            st.caption(f"95% prediction interval: ${max(lower, 0):,.2f} – ${upper:,.2f}")
+
+        # Cost category
+        if pred_value < 8000:
+            st.success("💰 **Low Cost Range**")
+            st.write("This is below average for most plans")
+        elif pred_value < 15000:
+            st.warning("💵 **Moderate Cost Range**")
+            st.write("This is typical for standard plans")
+        else:
+            st.error("💸 **High Cost Range**")
+            st.write("Consider premium coverage options")
+
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    with col3:
+        # Quick stats
+        st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+        st.metric("Age Impact", f"+{r_age * 250:,.0f}")
+        st.metric("BMI Impact", f"+{max(0, (r_bmi - 18.5) * 300):,.0f}")
+        st.metric("Smoker Impact", f"+{15000 if r_smoker == 'Yes' else 0:,.0f}")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # Feature impact visualization
+    st.subheader("📈 Feature Impact Analysis")
+    st.plotly_chart(result['impact_fig'], use_container_width=True)
+
+    # Show input features in an attractive way
+    with st.expander("🔍 View Detailed Input Features"):
+        st.dataframe(result['feature_df'].style.background_gradient(subset=['Impact (USD)'], cmap='Blues'), use_container_width=True)
+
 # Example scenarios
 st.markdown("---")
 st.subheader("💡 Example Scenarios")
@@ -460,3 +546,5 @@ st.markdown(
     unsafe_allow_html=True
 
 )
+
+profiling.finish_rerun(_profiler)
@@ -0,0 +1,305 @@
+# profiling.py
+"""
+Opt-in per-rerun profiling for the Streamlit apps.
+
+Enable with the INSURANCE_PROFILE environment variable or the `?profile=`
+query parameter:
+    INSURANCE_PROFILE=1       cProfile (deterministic, exact call counts)
+    INSURANCE_PROFILE=sample  stack sampler (low overhead, real stacks)
+
+On Python 3.12+ cProfile hooks every thread in the process (sys.monitoring),
+so one session's profile would include the others' work; there the stack
+sampler is used for every session and the panel says so.
+
+Each script run is written to INSURANCE_PROFILE_DIR (default `profiles/`):
+    <stamp>-<script>.prof    pstats file (cProfile mode), open with snakeviz
+    <stamp>-<script>.folded  collapsed stacks weighted in microseconds (sample mode),
+                             feed to flamegraph.pl or speedscope
+    <stamp>-<script>.txt     top-N hot-function summary
+and the breakdown of the run is shown in a sidebar panel.
+
+Usage in an app script (right after st.set_page_config):
+    _profiler = profiling.start_rerun("main", watch={...})
+    ...
+    profiling.finish_rerun(_profiler)
+
+A run that never reaches finish_rerun (an exception, st.stop()) is saved with
+an `-aborted` suffix when the session's next run starts.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENV = "INSURANCE_PROFILE"
+PROFILE_DIR_ENV = "INSURANCE_PROFILE_DIR"
+TOP_N = int(os.environ.get("INSURANCE_PROFILE_TOP", "25"))
+SAMPLE_INTERVAL = 0.005
+NATIVE_NOTE = "C functions are invisible to the sampler; their time is counted on the calling line"
+# cProfile is process-wide from 3.12 on and cannot be scoped to one session's thread
+CPROFILE_PER_THREAD = sys.version_info < (3, 12)
+PROCESS_WIDE_NOTE = "cProfile is process-wide on Python 3.12+, so the stack sampler was used instead"
+
+# session_state keys: the running profile, and where the last aborted run was saved
+ACTIVE_KEY = "_profiling_active"
+ABORTED_KEY = "_profiling_aborted"
+
+
+def requested_mode():
+    """Returns None (off), "cprofile" or "sample". The query parameter wins over the env var."""
+    value = os.environ.get(PROFILE_ENV, "")
+    query_params = getattr(st, "query_params", None)
+    if query_params is not None:
+        value = query_params.get("profile", value)
+    else:  # streamlit < 1.30
+        value = st.experimental_get_query_params().get("profile", [value])[0]
+    value = str(value).strip().lower()
+    if value in ("", "0", "off", "false", "no"):
+        return None
+    return "sample" if value == "sample" else "cprofile"
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread about every `interval` seconds. Each
+    sample is weighted by the measured time since the previous one, so time
+    lost to the wait, the stack walk or GIL contention is still accounted for.
+
+    Only Python frames are visible: time inside C functions (time.sleep,
+    socket reads, ...) is counted against the Python line that called them,
+    so each sample is keyed on (stack, line number of the innermost frame).
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # (stack, line) -> seconds
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._last = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, self._last = now - self._last, now
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            lineno = frame.f_lineno
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            self.stacks[(tuple(reversed(stack)), lineno)] += elapsed
+
+
+class RerunProfile:
+    def __init__(self, script, mode, watch):
+        self.script = script
+        self.mode = mode
+        self.watch = watch
+        self.started = time.perf_counter()
+        self.stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.note = None
+        if mode == "cprofile" and not CPROFILE_PER_THREAD:
+            self.mode, self.note = "sample", PROCESS_WIDE_NOTE
+        if self.mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = StackSampler(threading.get_ident())
+            self.profiler.start()
+
+    def stop(self):
+        if self.mode == "sample":
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+
+def start_rerun(script, watch=None):
+    """
+    Start profiling this script run if profiling is requested; returns a handle
+    or None. `watch` maps a label to the function whose cumulative time should
+    be reported separately, given as an exact name or a (file path suffix,
+    name) pair, e.g. {"Model load": ("joblib/numpy_pickle.py", "load")}.
+    """
+    stale = st.session_state.pop(ACTIVE_KEY, None)
+    if stale is not None:
+        stale.stop()
+        _, _, _, saved = _save(stale, aborted=True)
+        st.session_state[ABORTED_KEY] = saved
+    mode = requested_mode()
+    if not mode:
+        return None
+    handle = st.session_state[ACTIVE_KEY] = RerunProfile(script, mode, watch or {})
+    return handle
+
+
+def _label(filename, func, lineno):
+    return f"{func} ({os.path.basename(filename)}:{lineno})"
+
+
+def _matches(spec, filename, func):
+    """`spec` is a function name or a (file path suffix, function name) pair; names match exactly."""
+    if isinstance(spec, str):
+        return func == spec
+    file_suffix, name = spec
+    return func == name and filename.replace(os.sep, "/").endswith(file_suffix)
+
+
+def _is_native(spec):
+    name = spec if isinstance(spec, str) else spec[1]
+    return name.startswith("<") or (not isinstance(spec, str) and spec[0] == "~")
+
+
+def _watched(rows, watch, native_visible=True):
+    """Cumulative seconds per watch entry; None where the profiler cannot see the function."""
+    return {label: None if not native_visible and _is_native(spec)
+            else sum(r["cumulative_s"] for r in rows if _matches(spec, r["_file"], r["_name"]))
+            for label, spec in watch.items()}
+
+
+def _top_from_cprofile(profiler, watch):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, lineno, func), (cc, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": _label(filename, func, lineno),
+            "calls": ncalls,
+            "self_s": tottime,
+            "cumulative_s": cumtime,
+            "_file": filename,
+            "_name": func,
+        })
+    watched = _watched(rows, watch)
+    rows.sort(key=lambda r: r["self_s"], reverse=True)
+    return rows[:TOP_N], watched
+
+
+def _top_from_samples(sampler, watch):
+    line_seconds, total_seconds = Counter(), Counter()
+    for (stack, lineno), seconds in sampler.stacks.items():
+        line_seconds[(stack[-1], lineno)] += seconds
+        for frame in set(stack):
+            total_seconds[frame] += seconds
+    functions = [{
+        "cumulative_s": seconds,
+        "_file": frame[0],
+        "_name": frame[1],
+    } for frame, seconds in total_seconds.items()]
+    watched = _watched(functions, watch, native_visible=False)
+    # self time is per line, which includes any C calls made from that line
+    rows = [{
+        "function": f"{frame[1]} ({os.path.basename(frame[0])}, line {lineno})",
+        "calls": None,
+        "self_s": seconds,
+        "cumulative_s": total_seconds[frame],
+    } for (frame, lineno), seconds in line_seconds.items()]
+    rows.sort(key=lambda r: r["self_s"], reverse=True)
+    return rows[:TOP_N], watched
+
+
+def _write_files(handle, wall, top, watched, aborted):
+    directory = os.environ.get(PROFILE_DIR_ENV, "profiles")
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{handle.stamp}-{handle.script}{'-aborted' if aborted else ''}")
+
+    if handle.mode == "sample":
+        with open(base + ".folded", "w") as f:
+            for (stack, lineno), seconds in handle.profiler.stacks.items():
+                frames = [_label(*frame) for frame in stack[:-1]] + [_label(*stack[-1][:2], lineno)]
+                f.write(f"{';'.join(frames)} {round(seconds * 1e6)}\n")
+    else:
+        handle.profiler.dump_stats(base + ".prof")
+
+    out = io.StringIO()
+    if aborted:
+        out.write(f"{handle.script} rerun at {handle.stamp}: aborted before finish_rerun, wall time unknown ({handle.mode})\n\n")
+    else:
+        out.write(f"{handle.script} rerun at {handle.stamp}: {wall:.3f} s wall ({handle.mode})\n\n")
+    if handle.note:
+        out.write(f"Note: {handle.note}\n\n")
+    if watched:
+        out.write("Watched (cumulative s):\n")
+        for label, seconds in watched.items():
+            out.write(f"  {label:<28}" + (f"{seconds:10.4f}\n" if seconds is not None else f"{'n/a':>10}\n"))
+        if None in watched.values():
+            out.write(f"  (n/a: {NATIVE_NOTE})\n")
+        out.write("\n")
+    out.write(f"Top {len(top)} {'lines' if handle.mode == 'sample' else 'functions'} by self time:\n")
+    out.write(f"  {'self_s':>10}{'cum_s':>10}{'calls':>10}  function\n")
+    for r in top:
+        calls = "" if r["calls"] is None else r["calls"]
+        out.write(f"  {r['self_s']:10.4f}{r['cumulative_s']:10.4f}{calls:>10}  {r['function']}\n")
+    with open(base + ".txt", "w") as f:
+        f.write(out.getvalue())
+    return base
+
+
+def _save(handle, aborted=False):
+    """Summarize a stopped profile and write it to disk; returns (wall, top, watched, saved path or None)."""
+    wall = None if aborted else time.perf_counter() - handle.started
+    if handle.mode == "sample":
+        top, watched = _top_from_samples(handle.profiler, handle.watch)
+    else:
+        top, watched = _top_from_cprofile(handle.profiler, handle.watch)
+    try:
+        saved = _write_files(handle, wall, top, watched, aborted)
+    except OSError:
+        logger.exception("profiling: could not save %s profile", handle.script)
+        saved = None
+    return wall, top, watched, saved
+
+
+def finish_rerun(handle):
+    """Stop profiling, save the profile and summary, and show the breakdown in the sidebar."""
+    if handle is None:
+        return
+    st.session_state.pop(ACTIVE_KEY, None)
+    handle.stop()
+    wall, top, watched, saved = _save(handle)
+    if saved is None:
+        st.sidebar.warning("⚠️ Could not save profile, see the server log.")
+
+    with st.sidebar.expander("⏱️ Profiling: last rerun", expanded=False):
+        st.metric("Script run time", f"{wall * 1000:,.0f} ms", help=f"Profiler: {handle.mode}")
+        if handle.note:
+            st.caption(f"ℹ️ {handle.note}")
+        if watched:
+            st.dataframe(
+                [{"Area": label, "Cumulative (ms)": "n/a" if seconds is None else f"{seconds * 1000:,.1f}"}
+                 for label, seconds in watched.items()],
+                use_container_width=True, hide_index=True,
+            )
+            if None in watched.values():
+                st.caption(f"n/a: {NATIVE_NOTE}")
+        st.dataframe(
+            [{"Function": r["function"], "Self (ms)": round(r["self_s"] * 1000, 2),
+              "Cumulative (ms)": round(r["cumulative_s"] * 1000, 2)} for r in top[:10]],
+            use_container_width=True, hide_index=True,
+        )
+        if saved:
+            st.caption(f"Saved to `{saved}.*`")
+        aborted = st.session_state.pop(ABORTED_KEY, None)
+        if aborted:
+            st.caption(f"⚠️ The previous rerun did not finish; its profile was saved to `{aborted}.*`")
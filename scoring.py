@@ -0,0 +1,136 @@
+# scoring.py
+"""
+Feature encoding and scoring shared by the Streamlit app and the offline tools.
+
+The encodings match the notebook (Medical_cost_prediction.ipynb) that trained
+`insurance_model.pkl`.
+"""
+import hashlib
+import os
+
+import joblib
+import numpy as np
+
+# --- mappings used in the notebook ---
+SEX_MAP = {"Male": 0, "Female": 1}
+SMOKER_MAP = {"Yes": 0, "No": 1}
+REGION_MAP = {
+    "Southeast": 0,
+    "Southwest": 1,
+    "Northeast": 2,
+    "Northwest": 3
+}
+
+FEATURES = ["age", "sex", "bmi", "children", "smoker", "region"]
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Return the hex SHA-256 digest of a file (used as the model hash)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode_row(age, sex, bmi, children, smoker, region):
+    """Returns [age, sex_encoded, bmi, children, smoker_encoded, region_encoded]"""
+    return [age, SEX_MAP[sex], bmi, children, SMOKER_MAP[smoker], REGION_MAP[region]]
+
+
+def prepare_input(age, sex, bmi, children, smoker, region):
+    """
+    Returns a 2D numpy array in the same order the model expects:
+    [age, sex_encoded, bmi, children, smoker_encoded, region_encoded]
+    """
+    return np.array(encode_row(age, sex, bmi, children, smoker, region), dtype=float).reshape(1, -1)
+
+
+def prepare_batch(rows):
+    """Encode an iterable of raw input dicts (keys as in FEATURES) into an (n, 6) array."""
+    return np.array([encode_row(*(r[f] for f in FEATURES)) for r in rows], dtype=float)
+
+
+def predict(model, X):
+    """Point predictions for an already-encoded (n, 6) array."""
+    return np.asarray(model.predict(np.asarray(X, dtype=float)), dtype=float)
+
+
+# --- prediction intervals ---
+def stats_path_for(model_path):
+    """Sidecar file holding the interval statistics for a model, e.g. insurance_model_stats.pkl"""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}_stats.pkl"
+
+
+def fit_interval_stats(model, X_train, y_train, X_holdout=None, y_holdout=None):
+    """
+    Statistics needed for prediction intervals, computed once at training time.
+
+    For a LinearRegression this is the residual variance and (XᵀX)⁻¹ of the
+    design matrix with an intercept column, which give exact OLS prediction
+    intervals. Sorted residuals (from the hold-out set when given) are stored
+    for every model and used as the fallback for non-linear ones.
+    """
+    X = np.asarray(X_train, dtype=float)
+    y = np.asarray(y_train, dtype=float)
+    n, p = X.shape
+    residuals = y - predict(model, X)
+    stats = {"n_features": p, "kind": "quantile"}
+
+    if hasattr(model, "coef_") and hasattr(model, "intercept_"):
+        design = np.column_stack([np.ones(n), X])
+        dof = n - design.shape[1]
+        stats.update({
+            "kind": "ols",
+            "coef": np.append(np.ravel(model.intercept_), np.ravel(model.coef_)),
+            "sigma2": float(residuals @ residuals / dof),
+            "xtx_inv": np.linalg.pinv(design.T @ design),
+            "dof": dof,
+        })
+
+    if X_holdout is not None:
+        residuals = np.asarray(y_holdout, dtype=float) - predict(model, X_holdout)
+    stats["residuals"] = np.sort(residuals)
+    return stats
+
+
+def save_interval_stats(stats, model_path):
+    """
+    Write `stats` next to the already-saved model at `model_path`, stamped with
+    the model file's SHA-256 so a sidecar left over from another fit is detected.
+    """
+    stats = dict(stats, model_sha256=file_sha256(model_path))
+    path = stats_path_for(model_path)
+    joblib.dump(stats, path)
+    return path
+
+
+def stats_match_model(stats, model_hash):
+    """True if `stats` were saved for the model file with SHA-256 `model_hash`."""
+    return stats.get("model_sha256") == model_hash
+
+
+def predict_with_interval(model, X, stats, level=0.95):
+    """
+    Point predictions with (lower, upper) prediction bounds for an encoded (n, 6) array.
+
+    OLS models use the closed form
+        ŷ ± t(1-α/2, dof) · sqrt(σ² · (1 + x₀ᵀ (XᵀX)⁻¹ x₀))
+    evaluated for the whole batch with one einsum. Other models fall back to
+    the stored empirical residual quantiles.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    pred = predict(model, X)
+    alpha = 1.0 - level
+
+    if stats.get("kind") == "ols":
+        from scipy.stats import t
+
+        design = np.column_stack([np.ones(len(X)), X])
+        leverage = np.einsum("ij,jk,ik->i", design, stats["xtx_inv"], design)
+        half_width = t.ppf(1 - alpha / 2, stats["dof"]) * np.sqrt(stats["sigma2"] * (1.0 + leverage))
+        return pred, pred - half_width, pred + half_width
+
+    lo, hi = np.quantile(stats["residuals"], [alpha / 2, 1 - alpha / 2])
+    return pred, pred + lo, pred + hi
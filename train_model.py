@@ -0,0 +1,55 @@
+# train_model.py
+"""
+Script version of the training steps in Medical_cost_prediction.ipynb.
+
+Fits the LinearRegression on insurance.csv with the notebook's encoding and
+split, then saves the model together with the statistics needed for
+prediction intervals (see scoring.fit_interval_stats):
+    python train_model.py --data insurance.csv --out insurance_model.pkl
+writes insurance_model.pkl and insurance_model_stats.pkl.
+"""
+import argparse
+
+import joblib
+import pandas as pd
+from sklearn import metrics
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import train_test_split
+
+from scoring import fit_interval_stats, save_interval_stats
+
+
+def load_data(path):
+    data = pd.read_csv(path)
+    # same encodings as the notebook
+    data.replace({'sex': {'male': 0, 'female': 1}}, inplace=True)
+    data.replace({'smoker': {'yes': 0, 'no': 1}}, inplace=True)
+    data.replace({'region': {'southeast': 0, 'southwest': 1, 'northeast': 2, 'northwest': 3}}, inplace=True)
+    X = data.drop(columns='charges', axis=1)
+    Y = data['charges']
+    return X, Y
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the insurance cost model.")
+    parser.add_argument("--data", default="insurance.csv")
+    parser.add_argument("--out", default="insurance_model.pkl")
+    args = parser.parse_args(argv)
+
+    X, Y = load_data(args.data)
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=2)
+
+    insurance = LinearRegression()
+    insurance.fit(X_train, Y_train)
+    print("R Squared (train):", metrics.r2_score(Y_train, insurance.predict(X_train)))
+    print("R Squared (test):", metrics.r2_score(Y_test, insurance.predict(X_test)))
+
+    stats = fit_interval_stats(insurance, X_train, Y_train, X_test, Y_test)
+    joblib.dump(insurance, args.out)
+    stats_path = save_interval_stats(stats, args.out)
+    print(f"Saved {args.out} and {stats_path} (residual std {stats['sigma2'] ** 0.5:,.2f})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())